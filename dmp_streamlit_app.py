@@ -1,8 +1,12 @@
 # dmp_streamlit_app.py
 import re
-from datetime import datetime
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING
 import streamlit as st
-from fpdf import FPDF
+
+if TYPE_CHECKING:
+    from fpdf import FPDF
 
 st.set_page_config(page_title="DMP Assignment", layout="centered")
 st.title("Data Management Plan (DMP)")
@@ -21,12 +25,55 @@ st.markdown("""
 - Practical data exercises will take place mainly on **CoCalc**, not here.
 """)
 
+FONT_PATH = Path(__file__).parent / "fonts" / "DejaVuSans.ttf"
+
+# (PDF title, form question, word limit); None marks the free-text ranking question
+SECTION_SPEC = (
+    ("Data Description", "Data Description", 150),
+    ("Storage and Backup", "Storage and Backup", 150),
+    ("Access and Security", "Access and Security", 150),
+    ("Long-term Preservation", "Long-term Preservation", 150),
+    ("Roles and Responsibilities", "Roles and Responsibilities", 150),
+    ("Topic Ranking", "Rank the following topics from easiest to hardest", None),
+    ("Hardest Topic Reflection", "What was the hardest topic to plan for, and why?", 50),
+    ("Easiest Topic Reflection", "What was the easiest topic to plan for, and why?", 50),
+    ("Peer Review Question", "What would you ask a peer reviewer advice on, and why?", 50),
+    ("LLM Acknowledgement", "Have you used generative AI or LLM tools for this assignment? If so, how?", 50),
+)
+SECTION_TITLES = tuple(title for title, _, _ in SECTION_SPEC)
+RANKED_TOPICS = ", ".join(SECTION_TITLES[:5])
+NO_RESPONSE = "[No response provided]"
+_LONG_TOKEN_MAXLEN = 80
+_LONG_TOKEN = re.compile(rf"\S{{{_LONG_TOKEN_MAXLEN + 1},}}")
+
 # ---------- Helpers ----------
+LONG_TEXT_CHARS = 4096
+
 def word_count(text: str) -> int:
+    # Blank answers skip the token list entirely. Long ASCII pastes use the
+    # NumPy byte scan; anything else keeps str.split(), which also splits on
+    # Unicode whitespace such as the non-breaking spaces word processors emit.
+    if not text or text.isspace():
+        return 0
+    if len(text) >= LONG_TEXT_CHARS and text.isascii():
+        return _word_count_long(text)
     return len(text.split())
 
+def _word_count_long(text: str) -> int:
+    """Count words in long ASCII text without materializing a list of tokens.
+
+    Counts non-space bytes that follow a space (or start the text), using the
+    ASCII whitespace set of str.split(). Callers must pass ASCII-only text.
+    """
+    import numpy as np  # already loaded by Streamlit; kept off the short path
+
+    b = np.frombuffer(text.encode("ascii"), np.uint8)
+    ws = (b == 32) | ((b >= 9) & (b <= 13)) | ((b >= 28) & (b <= 31))
+    return int((ws[:-1] & ~ws[1:]).sum()) + int(not ws[0])
+
 def text_section(label: str, max_words: int):
-    text = st.text_area(label, height=150)
+    key = "sec_" + label.lower().replace(" ", "_")
+    text = st.text_area(label, height=150, key=key)
     wc = word_count(text)
     st.caption(f"Word count: {wc} / {max_words}")
     ok = wc <= max_words
@@ -34,106 +81,139 @@ def text_section(label: str, max_words: int):
         st.warning("Word limit exceeded. Please shorten your response.")
     return text, ok
 
-def break_long_tokens(s: str, maxlen: int = 80) -> str:
+def break_long_tokens(s: str, maxlen: int = _LONG_TOKEN_MAXLEN) -> str:
     """Insert spaces in very-long tokens so fpdf2 can wrap them."""
+    s = s or ""
+    if len(s) <= maxlen:
+        return s
+    if maxlen == _LONG_TOKEN_MAXLEN:
+        pattern = _LONG_TOKEN
+    else:
+        pattern = re.compile(rf"\S{{{maxlen + 1},}}")
+
     def _breaker(match):
-        tok = match.group(0)
+        tok = match[0]
         return " ".join(tok[i:i+maxlen] for i in range(0, len(tok), maxlen))
-    return re.sub(rf"\S{{{maxlen+1},}}", _breaker, s or "")
+    return pattern.sub(_breaker, s)
+
+def new_pdf() -> tuple["FPDF", float]:
+    """Start a document with the submission-independent prefix: page, font, title.
+
+    Returns the document and its content width, shared by every later cell.
+
+    Built fresh each time rather than copied from a template: fpdf2 font
+    objects carry per-document glyph-subset state that a copy would share.
+    """
+    # Imported lazily: only needed once a submission is exported
+    from fpdf import FPDF, XPos, YPos
 
-def build_pdf_bytes(sections: dict) -> bytes:
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
 
-    # Register and use DejaVu font
-    pdf.add_font("DejaVu", "", "fonts/DejaVuSans.ttf", uni=True)
+    # Register and use DejaVu font (TTF fonts are always Unicode in fpdf2)
+    pdf.add_font("DejaVu", "", str(FONT_PATH))
 
-    left = pdf.l_margin
-    right = pdf.r_margin
-    content_w = pdf.w - left - right
-
-    # Header
     pdf.set_font("DejaVu", size=12)
-    pdf.cell(content_w, 10, "Data Management Plan Submission", ln=True, align="C")
+    content_w = pdf.w - pdf.l_margin - pdf.r_margin
+    pdf.cell(content_w, 10, "Data Management Plan Submission",
+             new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
     pdf.ln(2)
+    return pdf, content_w
+
+def build_pdf_bytes(sections: tuple, generated: str) -> bytes:
+    """Render already-normalized (title, body) pairs into a PDF stamped `generated`."""
+    from fpdf import XPos, YPos
+
+    pdf, content_w = new_pdf()
 
+    # Timestamp line under the title written by new_pdf()
     pdf.set_font("DejaVu", size=10)
-    pdf.cell(content_w, 6, f"Generated: {datetime.now():%Y-%m-%d %H:%M}", ln=True)
+    pdf.cell(content_w, 6, f"Generated: {generated}",
+             new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(2)
 
-    # Sections
-    for title, content in sections.items():
-        pdf.set_font("DejaVu", size=11)
-        pdf.set_x(left)                      # reset alignment
-        pdf.multi_cell(content_w, 6, title)
-
-        pdf.set_font("DejaVu", size=10)
-        body = (content or "").strip() or "[No response provided]"
-        body = break_long_tokens(body, maxlen=80)
-        pdf.set_x(left)                      # reset alignment again
-        pdf.multi_cell(content_w, 6, body)
-        pdf.ln(1)
-
-
-    pdf_output = pdf.output(dest="S")
-    try:
-        pdf_bytes = pdf_output.encode("latin-1", "replace")
-    except AttributeError:
-        # pdf_output is already bytes
-        pdf_bytes = pdf_output
-    return bytes(pdf_bytes)
-    
+    # Sections: the family stays DejaVu throughout, so only the size flips
+    # between titles and bodies (set_font would re-resolve the font each time)
+    for title, body in sections:
+        pdf.set_font_size(11)
+        # Titles are fixed single-line strings: a plain cell skips multi_cell's
+        # line-breaking pass, leaving one multi_cell per section (the body)
+        pdf.cell(content_w, 6, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+        pdf.set_font_size(10)
+        pdf.multi_cell(content_w, 6, break_long_tokens(body))
+        pdf.ln(1)                            # also resets x to the left margin
+
+    # fpdf2 returns a bytearray; no legacy str/latin-1 handling needed
+    return bytes(pdf.output())
+
+# Narrow on purpose: reruns are served from the session's dmp_pdf slot and the
+# key includes the minute stamp, so this only hits when identical answers are
+# resubmitted within the same minute. The short ttl keeps answers from lingering.
+@st.cache_data(show_spinner=False, max_entries=64, ttl=60)
+def _cached_pdf(sections_tuple: tuple, generated: str) -> bytes:
+    """Memoized build_pdf_bytes, keyed on the (title, content) pairs and timestamp.
+
+    The timestamp is part of the key so a resubmit never gets an older build's
+    "Generated:" line.
+    """
+    return build_pdf_bytes(sections_tuple, generated)
+
 # ---------- Form ----------
 with st.form("dmp_form", clear_on_submit=False):
-    sections = {}
+    values = []
     oks = []
 
-    st.subheader("1. Data Description (max 150 words)")
-    sections["Data Description"], ok1 = text_section("Data Description", 150); oks.append(ok1)
-
-    st.subheader("2. Storage and Backup (max 150 words)")
-    sections["Storage and Backup"], ok2 = text_section("Storage and Backup", 150); oks.append(ok2)
-
-    st.subheader("3. Access and Security (max 150 words)")
-    sections["Access and Security"], ok3 = text_section("Access and Security", 150); oks.append(ok3)
-
-    st.subheader("4. Long-term Preservation (max 150 words)")
-    sections["Long-term Preservation"], ok4 = text_section("Long-term Preservation", 150); oks.append(ok4)
-
-    st.subheader("5. Roles and Responsibilities (max 150 words)")
-    sections["Roles and Responsibilities"], ok5 = text_section("Roles and Responsibilities", 150); oks.append(ok5)
-
-    st.subheader("6. Rank the following topics from easiest to hardest")
-    st.write("Data Description, Storage and Backup, Access and Security, Long-term Preservation, Roles and Responsibilities")
-    sections["Topic Ranking"] = st.text_input("Write the topics in order: easiest → hardest")
-    oks.append(True)
-
-    st.subheader("7. What was the hardest topic to plan for, and why? (max 50 words)")
-    sections["Hardest Topic Reflection"], ok7 = text_section("Hardest Topic Reflection", 50); oks.append(ok7)
-
-    st.subheader("8. What was the easiest topic to plan for, and why? (max 50 words)")
-    sections["Easiest Topic Reflection"], ok8 = text_section("Easiest Topic Reflection", 50); oks.append(ok8)
-
-    st.subheader("9. What would you ask a peer reviewer advice on, and why? (max 50 words)")
-    sections["Peer Review Question"], ok9 = text_section("Peer Review Question", 50); oks.append(ok9)
-
-    st.subheader("10. Have you used generative AI or LLM tools for this assignment? If so, how? (max 50 words)")
-    sections["LLM Acknowledgement"], ok10 = text_section("LLM Acknowledgement", 50); oks.append(ok10)
-
+    for i, (title, question, max_words) in enumerate(SECTION_SPEC, start=1):
+        if max_words is None:
+            st.subheader(f"{i}. {question}")
+            st.write(RANKED_TOPICS)
+            values.append(st.text_input("Write the topics in order: easiest → hardest"))
+            oks.append(True)
+            continue
+        st.subheader(f"{i}. {question} (max {max_words} words)")
+        text, ok = text_section(title, max_words)
+        values.append(text)
+        oks.append(ok)
+
+    # Normalized once here, so bodies are already clean for the PDF and its cache key
+    sections = tuple(
+        (title, (value or "").strip() or NO_RESPONSE)
+        for title, value in zip(SECTION_TITLES, values)
+    )
     within_limits = all(oks)
     submitted = st.form_submit_button("Prepare PDF")
-    if submitted and not within_limits:
-        st.error("One or more sections exceed the word limit. Please revise your answers before exporting.")
+    if submitted:
+        if within_limits:
+            # New token per accepted submit; the PDF is built at most once per token
+            st.session_state.dmp_submit_token = str(uuid.uuid4())
+        else:
+            st.session_state.pop("dmp_submit_token", None)
+            st.error("One or more sections exceed the word limit. Please revise your answers before exporting.")
 
 # ---------- Download ----------
-if 'submitted' in locals() and submitted and within_limits:
-    pdf_bytes = bytes(build_pdf_bytes(sections))
+# A fragment: clicking Download reruns only this function, not the whole form
+@st.fragment
+def download_section(sections: tuple):
+    token = st.session_state.get("dmp_submit_token")
+    if not token:
+        st.info("Fill out the form and click **Prepare PDF**. When all word limits are satisfied, the download button will appear.")
+        return
+
+    cached = st.session_state.get("dmp_pdf")
+    if cached is not None and cached[0] == token:
+        pdf_bytes = cached[1]
+    else:
+        from datetime import datetime
+
+        pdf_bytes = _cached_pdf(sections, f"{datetime.now():%Y-%m-%d %H:%M}")
+        st.session_state.dmp_pdf = (token, pdf_bytes)
     st.download_button(
         label="Download PDF",
         data=pdf_bytes,
         file_name="dmp_submission.pdf",
         mime="application/pdf"
     )
-else:
-    st.info("Fill out the form and click **Prepare PDF**. When all word limits are satisfied, the download button will appear.")
+
+download_section(sections)